@@ -5,6 +5,7 @@ Copyright (c) 2019 Aiven Ltd
 See LICENSE for details
 """
 from avro.schema import Schema as AvroSchema
+from collections import OrderedDict
 from enum import Enum, unique
 from jsonschema import Draft7Validator
 from karapace.avro_compatibility import (
@@ -13,11 +14,18 @@ from karapace.avro_compatibility import (
 )
 from karapace.compatibility.jsonschema.checks import compatibility as jsonschema_compatibility
 from karapace.schema_reader import SchemaType, TypedSchema
+from typing import Any, Callable, Dict, Tuple
 
 import logging
 
 LOG = logging.getLogger(__name__)
 
+COMPATIBILITY_CACHE_SIZE = 4096
+
+# Results of a single reader/writer check keyed by the schema type of the checker and the fingerprints of both schemas,
+# most recently used last
+_compatibility_cache: "OrderedDict[Tuple[SchemaType, bytes, bytes], SchemaCompatibilityResult]" = OrderedDict()
+
 
 @unique
 class CompatibilityModes(Enum):
@@ -40,12 +48,17 @@ class CompatibilityModes(Enum):
     NONE = "NONE"
 
     def is_transitive(self) -> bool:
-        TRANSITIVE_MODES = {
-            "BACKWARD_TRANSITIVE",
-            "FORWARD_TRANSITIVE",
-            "FULL_TRANSITIVE",
-        }
-        return self.value in TRANSITIVE_MODES
+        return self in _TRANSITIVE_MODES
+
+
+_TRANSITIVE_MODES = frozenset({
+    CompatibilityModes.BACKWARD_TRANSITIVE,
+    CompatibilityModes.FORWARD_TRANSITIVE,
+    CompatibilityModes.FULL_TRANSITIVE,
+})
+_BACKWARD_MODES = frozenset({CompatibilityModes.BACKWARD, CompatibilityModes.BACKWARD_TRANSITIVE})
+_FORWARD_MODES = frozenset({CompatibilityModes.FORWARD, CompatibilityModes.FORWARD_TRANSITIVE})
+_FULL_MODES = frozenset({CompatibilityModes.FULL, CompatibilityModes.FULL_TRANSITIVE})
 
 
 def check_avro_compatibility(reader_schema: AvroSchema, writer_schema: AvroSchema) -> SchemaCompatibilityResult:
@@ -63,6 +76,65 @@ def check_jsonschema_compatibility(reader: Draft7Validator, writer: Draft7Valida
     return jsonschema_compatibility(reader, writer)
 
 
+def _cached_check(
+    schema_type: SchemaType,
+    checker: Callable[[Any, Any], SchemaCompatibilityResult],
+    reader: TypedSchema,
+    writer: TypedSchema,
+) -> SchemaCompatibilityResult:
+    """ Runs the `schema_type` `checker` for the `reader` and `writer` schemas, reusing the result of a previous
+    identical check.
+
+    The checks are pure functions of the schemas, and the same pairs are compared repeatedly by the FULL and
+    transitive modes as a subject evolves. The schemas are keyed by their fingerprints, so that the cache stays small
+    regardless of the size of the schemas, and by the schema type of `checker`, so that a result is only ever
+    reused for the checker that computed it.
+    """
+    key = (schema_type, reader.fingerprint(), writer.fingerprint())
+    result = _compatibility_cache.get(key)
+    if result is not None:
+        _compatibility_cache.move_to_end(key)
+        return result
+
+    result = checker(reader.schema, writer.schema)
+    _compatibility_cache[key] = result
+    if len(_compatibility_cache) > COMPATIBILITY_CACHE_SIZE:
+        _compatibility_cache.popitem(last=False)
+    return result
+
+
+CompatibilityCheck = Callable[[TypedSchema, TypedSchema], SchemaCompatibilityResult]
+
+
+def _backward_check(schema_type: SchemaType, checker: Callable[[Any, Any], SchemaCompatibilityResult]) -> CompatibilityCheck:
+    return lambda old_schema, new_schema: _cached_check(schema_type, checker, reader=new_schema, writer=old_schema)
+
+
+def _forward_check(schema_type: SchemaType, checker: Callable[[Any, Any], SchemaCompatibilityResult]) -> CompatibilityCheck:
+    return lambda old_schema, new_schema: _cached_check(schema_type, checker, reader=old_schema, writer=new_schema)
+
+
+def _full_check(schema_type: SchemaType, checker: Callable[[Any, Any], SchemaCompatibilityResult]) -> CompatibilityCheck:
+    backward, forward = _backward_check(schema_type, checker), _forward_check(schema_type, checker)
+    return lambda old_schema, new_schema: backward(old_schema, new_schema).merged_with(forward(old_schema, new_schema))
+
+
+# Checks taking `(old_schema, new_schema)` with the reader and writer already wired for each schema type and mode. The
+# transitive modes differ only in which versions are checked, which is decided by the caller.
+_COMPATIBILITY_CHECKS: Dict[Tuple[SchemaType, CompatibilityModes], CompatibilityCheck] = {}
+for _schema_type, _checker in (
+    (SchemaType.AVRO, check_avro_compatibility),
+    (SchemaType.JSONSCHEMA, check_jsonschema_compatibility),
+):
+    for _modes, _make_check in (
+        (_BACKWARD_MODES, _backward_check),
+        (_FORWARD_MODES, _forward_check),
+        (_FULL_MODES, _full_check),
+    ):
+        for _mode in _modes:
+            _COMPATIBILITY_CHECKS[(_schema_type, _mode)] = _make_check(_schema_type, _checker)
+
+
 def check_compatibility(
     old_schema: TypedSchema, new_schema: TypedSchema, compatibility_mode: CompatibilityModes
 ) -> SchemaCompatibilityResult:
@@ -78,61 +150,16 @@ def check_compatibility(
         LOG.info("Compatibility level set to NONE, no schema compatibility checks performed")
         return SchemaCompatibilityResult.compatible()
 
-    if old_schema.schema_type is SchemaType.AVRO:
-        if compatibility_mode in {CompatibilityModes.BACKWARD, CompatibilityModes.BACKWARD_TRANSITIVE}:
-            result = check_avro_compatibility(
-                reader_schema=new_schema.schema,
-                writer_schema=old_schema.schema,
-            )
-
-        elif compatibility_mode in {CompatibilityModes.FORWARD, CompatibilityModes.FORWARD_TRANSITIVE}:
-            result = check_avro_compatibility(
-                reader_schema=old_schema.schema,
-                writer_schema=new_schema.schema,
-            )
-
-        elif compatibility_mode in {CompatibilityModes.FULL, CompatibilityModes.FULL_TRANSITIVE}:
-            result = check_avro_compatibility(
-                reader_schema=new_schema.schema,
-                writer_schema=old_schema.schema,
-            )
-            result = result.merged_with(
-                check_avro_compatibility(
-                    reader_schema=old_schema.schema,
-                    writer_schema=new_schema.schema,
-                )
-            )
-
-    elif old_schema.schema_type is SchemaType.JSONSCHEMA:
-        if compatibility_mode in {CompatibilityModes.BACKWARD, CompatibilityModes.BACKWARD_TRANSITIVE}:
-            result = check_jsonschema_compatibility(
-                reader=new_schema.schema,
-                writer=old_schema.schema,
-            )
-
-        elif compatibility_mode in {CompatibilityModes.FORWARD, CompatibilityModes.FORWARD_TRANSITIVE}:
-            result = check_jsonschema_compatibility(
-                reader=old_schema.schema,
-                writer=new_schema.schema,
-            )
-
-        elif compatibility_mode in {CompatibilityModes.FULL, CompatibilityModes.FULL_TRANSITIVE}:
-            result = check_jsonschema_compatibility(
-                reader=new_schema.schema,
-                writer=old_schema.schema,
-            )
-            result = result.merged_with(
-                check_jsonschema_compatibility(
-                    reader=old_schema.schema,
-                    writer=new_schema.schema,
-                )
-            )
-
-    else:
-        result = SchemaCompatibilityResult.incompatible(
+    if old_schema == new_schema:
+        # A schema is always compatible with itself, skip the traversal for re-registrations
+        return SchemaCompatibilityResult.compatible()
+
+    check = _COMPATIBILITY_CHECKS.get((old_schema.schema_type, compatibility_mode))
+    if check is None:
+        return SchemaCompatibilityResult.incompatible(
             incompat_type=SchemaIncompatibilityType.type_mismatch,
             message=f"Unknow schema_type {old_schema.schema_type}",
             location=[],
         )
 
-    return result
+    return check(old_schema, new_schema)
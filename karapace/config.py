@@ -50,6 +50,11 @@ DEFAULTS = {
     "producer_count": 5,
     "producer_linger_ms": 0,
     "session_timeout_ms": 10000,
+    "schema_reader_fetch_min_bytes": 1,
+    "schema_reader_fetch_max_wait_ms": 500,
+    "schema_reader_max_partition_fetch_bytes": 4 * 1024 * 1024,
+    "schema_reader_max_poll_records": 500,
+    "schema_reader_poll_timeout_ms": 1000,
     "karapace_rest": False,
     "karapace_registry": False,
     "master_election_strategy": "lowest"
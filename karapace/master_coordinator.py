@@ -11,7 +11,7 @@ from kafka.metrics import MetricConfig, Metrics
 from karapace import constants
 from karapace.utils import KarapaceKafkaClient
 from threading import Lock, Thread
-from typing import Optional, Tuple
+from typing import Callable, List, Optional, Tuple
 
 import json
 import logging
@@ -21,6 +21,8 @@ import time
 NO_ERROR = 0
 DUPLICATE_URLS = 1
 
+MasterChangeCallback = Callable[[Optional[bool]], None]
+
 
 def get_identity_url(scheme, host, port):
     return "{}://{}:{}".format(scheme, host, port)
@@ -34,6 +36,7 @@ class SchemaCoordinator(BaseCoordinator):
     are_we_master = None
     master_url = None
     master_eligibility = True
+    master_change_callback = None
 
     def __init__(self, *args, **kwargs) -> None:
         super().__init__(*args, **kwargs)
@@ -48,12 +51,18 @@ class SchemaCoordinator(BaseCoordinator):
             return json.dumps(res)
         return res
 
+    def _set_master(self, are_we_master: Optional[bool], master_url: Optional[str]) -> None:
+        self.master_url = master_url
+        self.are_we_master = are_we_master
+        if self.master_change_callback is not None:
+            self.master_change_callback(are_we_master)
+
     def group_protocols(self):
         return [("v0", self.get_identity(host=self.hostname, port=self.port, scheme=self.scheme))]
 
     def _perform_assignment(self, leader_id, protocol, members):
         self.log.info("Creating assignment: %r, protocol: %r, members: %r", leader_id, protocol, members)
-        self.are_we_master = None
+        self._set_master(None, self.master_url)
         error = NO_ERROR
         urls = {}
         fallback_urls = {}
@@ -105,14 +114,11 @@ class SchemaCoordinator(BaseCoordinator):
         )
         # On Kafka protocol we can be assigned to be master, but if not master eligible, then we're not master for real
         if member_assignment["master"] == member_id and member_identity["master_eligibility"]:
-            self.master_url = master_url
-            self.are_we_master = True
+            self._set_master(True, master_url)
         elif not member_identity["master_eligibility"]:
-            self.master_url = None
-            self.are_we_master = False
+            self._set_master(False, None)
         else:
-            self.master_url = master_url
-            self.are_we_master = False
+            self._set_master(False, master_url)
         return super(SchemaCoordinator, self)._on_join_complete(generation, member_id, protocol, member_assignment_bytes)
 
     def _on_join_follower(self):
@@ -135,6 +141,8 @@ class MasterCoordinator(Thread):
         self._metrics = Metrics(metric_config, reporters=[])
         self.lock = Lock()
         self.lock.acquire()
+        self._master_change_callbacks: List[MasterChangeCallback] = []
+        self._master_change_lock = Lock()
         self.log = logging.getLogger("MasterCoordinator")
 
     def init_kafka_client(self):
@@ -172,6 +180,7 @@ class MasterCoordinator(Thread):
         self.sc.port = self.config["port"]
         self.sc.scheme = "http"
         self.sc.master_eligibility = self.config["master_eligibility"]
+        self.sc.master_change_callback = self._on_master_change
         self.lock.release()  # self.sc now exists, we get to release the lock
 
     def get_master_info(self) -> Tuple[bool, Optional[str]]:
@@ -179,6 +188,17 @@ class MasterCoordinator(Thread):
         with self.lock:
             return self.sc.are_we_master, self.sc.master_url
 
+    def add_master_change_callback(self, callback: MasterChangeCallback) -> None:
+        """Call `callback` with the current master state now, and from the coordinator thread whenever it changes"""
+        with self._master_change_lock:
+            self._master_change_callbacks.append(callback)
+            callback(self.sc.are_we_master if self.sc is not None else None)
+
+    def _on_master_change(self, are_we_master: Optional[bool]) -> None:
+        with self._master_change_lock:
+            for callback in self._master_change_callbacks:
+                callback(are_we_master)
+
     def close(self):
         self.log.info("Closing master_coordinator")
         self.running = False
@@ -4,6 +4,7 @@ karapace - schema backup
 Copyright (c) 2019 Aiven Ltd
 See LICENSE for details
 """
+from itertools import chain
 from kafka import KafkaConsumer, KafkaProducer
 from kafka.admin import KafkaAdminClient
 from kafka.errors import NoBrokersAvailable, NodeNotReadyError, TopicAlreadyExistsError
@@ -11,6 +12,7 @@ from karapace import constants
 from karapace.config import Config, read_config
 from karapace.schema_reader import KafkaSchemaReader
 from karapace.utils import json_encode, KarapaceKafkaClient
+from threading import Event
 from typing import Optional
 
 import argparse
@@ -20,6 +22,10 @@ import os
 import sys
 import time
 
+RESTORE_BATCH_SIZE = 500
+RESTORE_LINGER_MS = 50
+RESTORE_RETRIES = 5
+
 
 class BackupError(Exception):
     """Backup Error"""
@@ -69,6 +75,13 @@ class SchemaBackup:
             sasl_plain_username=self.config["sasl_plain_username"],
             sasl_plain_password=self.config["sasl_plain_password"],
             kafka_client=KarapaceKafkaClient,
+            # The restore sends records back to back and only waits on the flushes, a small linger lets the producer
+            # fill its batches instead of sending one record per request
+            linger_ms=RESTORE_LINGER_MS,
+            # The records of a backup must land in order, a single in-flight request keeps the batches ordered when a
+            # transient error is retried
+            max_in_flight_requests_per_connection=1,
+            retries=RESTORE_RETRIES,
         )
 
     def init_admin_client(self):
@@ -104,13 +117,13 @@ class SchemaBackup:
 
         self.init_admin_client()
 
+        schema_topic = KafkaSchemaReader.get_new_schema_topic(self.config)
         start_time = time.monotonic()
         wait_time = constants.MINUTE
         while True:
             if time.monotonic() - start_time > wait_time:
                 raise Timeout(f"Timeout ({wait_time}) on creating admin client")
 
-            schema_topic = KafkaSchemaReader.get_new_schema_topic(self.config)
             try:
                 self.log.info("Creating schema topic: %r", schema_topic)
                 self.admin_client.create_topics([schema_topic], timeout_ms=constants.TOPIC_CREATION_TIMEOUT_MS)
@@ -150,21 +163,21 @@ class SchemaBackup:
             raw_msg = self.consumer.poll(timeout_ms=self.timeout_ms)
             topic_fully_consumed = len(raw_msg) == 0
 
-            for _, messages in raw_msg.items():
-                for message in messages:
+            for message in chain.from_iterable(raw_msg.values()):
+                # json.loads() accepts the UTF-8 bytes as is, they are only decoded to be kept verbatim when invalid
+                try:
+                    key = json.loads(message.key)
+                except json.JSONDecodeError:
+                    self.log.debug("Invalid JSON in message.key: %r, value: %r", message.key, message.value)
                     key = message.key.decode("utf8")
+                value = None
+                if message.value:
                     try:
-                        key = json.loads(key)
+                        value = json.loads(message.value)
                     except json.JSONDecodeError:
-                        self.log.debug("Invalid JSON in message.key: %r, value: %r", message.key, message.value)
-                    value = None
-                    if message.value:
+                        self.log.debug("Invalid JSON in message.value: %r, key: %r", message.value, message.key)
                         value = message.value.decode("utf8")
-                        try:
-                            value = json.loads(value)
-                        except json.JSONDecodeError:
-                            self.log.debug("Invalid JSON in message.value: %r, key: %r", message.value, message.key)
-                    values.append((key, value))
+                values.append((key, value))
 
         ser = json.dumps(values)
         if self.backup_location:
@@ -194,15 +207,44 @@ class SchemaBackup:
         if not values:
             return
 
-        for item in values:
+        # Records are sent without waiting on each one individually, the producer is flushed once per batch. This
+        # keeps the producer's own batching effective while bounding the number of pending futures.
+        # A send that fails after the retries stops the restore. The failure is only reported once the broker has
+        # answered, so the records after it in the same batch, and possibly later producer batches already handed to
+        # the producer, may have been written too. The errback only stops queueing new records.
+        send_failed = Event()
+        pending = []
+        for index, item in enumerate(values):
+            if send_failed.is_set():
+                break
             key = encode_value(item[0])
             value = encode_value(item[1])
             future = self.producer.send(self.topic_name, key=key, value=value)
-            self.producer.flush(timeout=self.timeout_ms)
-            msg = future.get(self.timeout_ms)
-            self.log.debug("Sent kafka msg key: %r, value: %r, offset: %r", key, value, msg.offset)
+            future.add_errback(lambda _: send_failed.set())
+            pending.append((index, key, value, future))
+            if len(pending) >= RESTORE_BATCH_SIZE:
+                self._flush_pending(pending)
+        self._flush_pending(pending)
         self.close()
 
+    def _flush_pending(self, pending):
+        if not pending:
+            return
+        self.producer.flush(timeout=self.timeout_ms)
+        log_sent = self.log.isEnabledFor(logging.DEBUG)
+        for index, key, value, future in pending:
+            try:
+                msg = future.get(self.timeout_ms)
+            except Exception:
+                self.log.error(
+                    "Restoring record %d with key: %r failed, the records before it were restored and records after it "
+                    "may have been restored too", index, key
+                )
+                raise
+            if log_sent:
+                self.log.debug("Sent kafka msg key: %r, value: %r, offset: %r", key, value, msg.offset)
+        pending.clear()
+
 
 def encode_value(value):
     if value == "null":
@@ -6,6 +6,7 @@ See LICENSE for details
 """
 from avro.schema import Schema as AvroSchema, SchemaParseException
 from enum import Enum, unique
+from itertools import chain
 from json import JSONDecodeError
 from jsonschema import Draft7Validator
 from jsonschema.exceptions import SchemaError
@@ -16,16 +17,26 @@ from karapace import constants
 from karapace.avro_compatibility import parse_avro_schema_definition
 from karapace.statsd import StatsClient
 from karapace.utils import json_encode, KarapaceKafkaClient
-from queue import Queue
-from threading import Lock, Thread
-from typing import Dict
+from threading import Condition, Event, Lock, Thread
+from typing import Callable, Dict, Optional
 
+import hashlib
 import json
 import logging
-import time
+
+try:
+    # orjson parses bytes directly and is considerably faster on the small documents of the schemas topic. Its
+    # JSONDecodeError is a subclass of json.JSONDecodeError, so the error handling is the same for both.
+    from orjson import loads as json_loads
+except ImportError:
+    json_loads = json.loads
 
 log = logging.getLogger(__name__)
 
+# Waits between the attempts to create the admin client and the schemas topic, doubled after every failure
+INIT_RETRY_BACKOFF_MIN_S = 1.0
+INIT_RETRY_BACKOFF_MAX_S = 30.0
+
 
 def parse_jsonschema_definition(schema_definition: str) -> Draft7Validator:
     """ Parses and validates `schema_definition`.
@@ -54,6 +65,8 @@ class TypedSchema:
         self.schema_type = schema_type
         self.schema = schema
         self.schema_str = schema_str
+        self._canonical_str: Optional[str] = None
+        self._fingerprint: Optional[bytes] = None
 
     @staticmethod
     def parse_json(schema_str: str):
@@ -87,7 +100,16 @@ class TypedSchema:
         return self.schema
 
     def __str__(self) -> str:
-        return json_encode(self.to_json(), compact=True)
+        # The parsed schema is never modified, so the canonical form is computed once and reused by comparisons
+        if self._canonical_str is None:
+            self._canonical_str = json_encode(self.to_json(), compact=True)
+        return self._canonical_str
+
+    def fingerprint(self) -> bytes:
+        """ A fixed size digest of the canonical form, for keys that should not keep the whole schema alive """
+        if self._fingerprint is None:
+            self._fingerprint = hashlib.blake2b(self.__str__().encode("utf8"), digest_size=16).digest()
+        return self._fingerprint
 
     def __repr__(self):
         return f"TypedSchema(type={self.schema_type}, schema={json_encode(self.to_json())})"
@@ -95,30 +117,51 @@ class TypedSchema:
     def __eq__(self, other):
         return isinstance(other, TypedSchema) and self.__str__() == other.__str__() and self.schema_type is other.schema_type
 
+    def __hash__(self):
+        return hash((self.__str__(), self.schema_type))
+
 
 class KafkaSchemaReader(Thread):
     def __init__(self, config, master_coordinator=None):
         Thread.__init__(self)
         self.master_coordinator = master_coordinator
         self.log = logging.getLogger("KafkaSchemaReader")
-        self.timeout_ms = 200
         self.config = config
+        self.timeout_ms = self.config["schema_reader_poll_timeout_ms"]
         self.subjects = {}
+        # The non-deleted schemas of each subject, replaced with an updated copy by the reader thread whenever it changes
+        self._live_schemas: Dict[str, dict] = {}
         self.schemas: Dict[int, TypedSchema] = {}
+        # Reverse index of `schemas`, keeps the first id a schema was seen with
+        self.schemas_to_id: Dict[TypedSchema, int] = {}
         self.global_schema_id = 0
         self.offset = 0
         self.admin_client = None
         self.schema_topic = None
         self.topic_replication_factor = self.config["replication_factor"]
         self.consumer = None
-        self.queue = Queue()
+        # The last offset published to writers waiting in wait_for_offset(), only advanced while we are the master
+        self.published_offset = -1
+        self._published_offset_condition = Condition()
         self.ready = False
+        # Follows the master state of the coordinator, see _on_master_change()
+        self._add_offsets = False
         self.running = True
+        self._closing = Event()
+        # Serializes the id allocation of get_schema_id(), single key reads and writes of the dicts are atomic already
         self.id_lock = Lock()
+        self._msg_handlers = {
+            "CONFIG": self._handle_msg_config,
+            "SCHEMA": self._handle_msg_schema,
+            "DELETE_SUBJECT": self._handle_msg_delete_subject,
+            "NOOP": self._handle_msg_noop,
+        }
         sentry_config = config.get("sentry", {"dsn": None}).copy()
         if "tags" not in sentry_config:
             sentry_config["tags"] = {}
         self.stats = StatsClient(sentry_config=sentry_config)
+        if self.master_coordinator is not None:
+            self.master_coordinator.add_master_change_callback(self._on_master_change)
 
     def init_consumer(self):
         # Group not set on purpose, all consumers read the same data
@@ -142,6 +185,10 @@ class KafkaSchemaReader(Thread):
             request_timeout_ms=request_timeout_ms,
             kafka_client=KarapaceKafkaClient,
             metadata_max_age_ms=self.config["metadata_max_age_ms"],
+            fetch_min_bytes=self.config["schema_reader_fetch_min_bytes"],
+            fetch_max_wait_ms=self.config["schema_reader_fetch_max_wait_ms"],
+            max_partition_fetch_bytes=self.config["schema_reader_max_partition_fetch_bytes"],
+            max_poll_records=self.config["schema_reader_max_poll_records"],
         )
 
     def init_admin_client(self):
@@ -161,10 +208,8 @@ class KafkaSchemaReader(Thread):
             return True
         except (NodeNotReadyError, NoBrokersAvailable, AssertionError):
             self.log.warning("No Brokers available yet, retrying init_admin_client()")
-            time.sleep(2.0)
         except:  # pylint: disable=bare-except
             self.log.exception("Failed to initialize admin client, retrying init_admin_client()")
-            time.sleep(2.0)
         return False
 
     @staticmethod
@@ -190,32 +235,40 @@ class KafkaSchemaReader(Thread):
             return True
         except:  # pylint: disable=bare-except
             self.log.exception("Failed to create topic: %r, retrying create_schema_topic()", self.config["topic_name"])
-            time.sleep(5)
         return False
 
-    def get_schema_id(self, new_schema):
+    def get_schema_id(self, new_schema: TypedSchema) -> int:
         with self.id_lock:
-            schemas = self.schemas.items()
-        for schema_id, schema in schemas:
-            if schema == new_schema:
+            schema_id = self.schemas_to_id.get(new_schema)
+            if schema_id is not None:
                 return schema_id
-        with self.id_lock:
             self.global_schema_id += 1
             return self.global_schema_id
 
     def close(self):
         self.log.info("Closing schema_reader")
         self.running = False
+        self._closing.set()
+
+    def _retry_with_backoff(self, init_step: Callable[[], bool]) -> bool:
+        """ Calls `init_step` until it succeeds, with an exponentially growing wait between the attempts.
+
+        Returns False if the reader was closed before `init_step` succeeded.
+        """
+        backoff = INIT_RETRY_BACKOFF_MIN_S
+        while self.running:
+            if init_step():
+                return True
+            # Unlike time.sleep() the wait ends as soon as close() is called
+            self._closing.wait(backoff)
+            backoff = min(backoff * 2, INIT_RETRY_BACKOFF_MAX_S)
+        return False
 
     def run(self):
+        if not self._retry_with_backoff(self.init_admin_client) or not self._retry_with_backoff(self.create_schema_topic):
+            self.running = False
         while self.running:
             try:
-                if not self.admin_client:
-                    if self.init_admin_client() is False:
-                        continue
-                if not self.schema_topic:
-                    if self.create_schema_topic() is False:
-                        continue
                 if not self.consumer:
                     self.init_consumer()
                 self.handle_messages()
@@ -233,147 +286,210 @@ class KafkaSchemaReader(Thread):
                 self.stats.unexpected_exception(ex=e, where="schema_reader_exit")
             self.log.exception("Unexpected exception closing schema reader")
 
+    def _on_master_change(self, are_we_master: Optional[bool]) -> None:
+        # keep old behavior for True. When are_we_master is False, then we are a follower, so we should not accept direct
+        # writes anyway. When are_we_master is None, then this particular node is waiting for a stable value, so any
+        # messages off the topic are writes performed by another node
+        # Also if master_elibility is disabled by configuration, disable writes too
+        self._add_offsets = are_we_master is True
+
     def handle_messages(self):
         raw_msgs = self.consumer.poll(timeout_ms=self.timeout_ms)
         if self.ready is False and raw_msgs == {}:
             self.ready = True
-        add_offsets = False
-        if self.master_coordinator is not None:
-            are_we_master, _ = self.master_coordinator.get_master_info()
-            # keep old behavior for True. When are_we_master is False, then we are a follower, so we should not accept direct
-            # writes anyway. When are_we_master is None, then this particular node is waiting for a stable value, so any
-            # messages off the topic are writes performed by another node
-            # Also if master_elibility is disabled by configuration, disable writes too
-            if are_we_master is True:
-                add_offsets = True
-
-        for _, msgs in raw_msgs.items():
-            for msg in msgs:
+        add_offsets = self.ready and self._add_offsets
+
+        # Checked once per poll, the per-record logging is a trace that is usually filtered out
+        log_records = self.log.isEnabledFor(logging.DEBUG)
+        # Bound once, these are looked up for every record otherwise
+        log_debug, log_exception = self.log.debug, self.log.exception
+        handle_msg = self.handle_msg
+        handled_offset: Optional[int] = None
+        for msg in chain.from_iterable(raw_msgs.values()):
+            try:
+                key = json_loads(msg.key)
+            except json.JSONDecodeError:
+                log_exception("Invalid JSON in msg.key: %r, value: %r", msg.key, msg.value)
+                continue
+
+            value = None
+            if msg.value:
                 try:
-                    key = json.loads(msg.key.decode("utf8"))
+                    value = json_loads(msg.value)
                 except json.JSONDecodeError:
-                    self.log.exception("Invalid JSON in msg.key: %r, value: %r", msg.key, msg.value)
+                    log_exception("Invalid JSON in msg.value: %r, key: %r", msg.value, msg.key)
                     continue
 
-                value = None
-                if msg.value:
-                    try:
-                        value = json.loads(msg.value.decode("utf8"))
-                    except json.JSONDecodeError:
-                        self.log.exception("Invalid JSON in msg.value: %r, key: %r", msg.value, msg.key)
-                        continue
-
-                self.log.info("Read new record: key: %r, value: %r, offset: %r", key, value, msg.offset)
-                self.handle_msg(key, value)
-                self.offset = msg.offset
-                self.log.info("Handled message, current offset: %r", self.offset)
-                if self.ready and add_offsets:
-                    self.queue.put(self.offset)
-
-    def handle_msg(self, key: dict, value: dict):
-        if key["keytype"] == "CONFIG":
-            if "subject" in key and key["subject"] is not None:
-                if not value:
-                    self.log.info("Deleting compatibility config completely for subject: %r", key["subject"])
-                    self.subjects[key["subject"]].pop("compatibility", None)
-                    return
-                self.log.info(
-                    "Setting subject: %r config to: %r, value: %r", key["subject"], value["compatibilityLevel"], value
-                )
-                if not key["subject"] in self.subjects:
-                    self.log.info("Adding first version of subject: %r with no schemas", key["subject"])
-                    self.subjects[key["subject"]] = {"schemas": {}}
-                subject_data = self.subjects.get(key["subject"])
-                subject_data["compatibility"] = value["compatibilityLevel"]
-            else:
-                self.log.info("Setting global config to: %r, value: %r", value["compatibilityLevel"], value)
-                self.config["compatibility"] = value["compatibilityLevel"]
-        elif key["keytype"] == "SCHEMA":
+            if log_records:
+                log_debug("Read new record: key: %r, value: %r, offset: %r", key, value, msg.offset)
+            handle_msg(key, value)
+            self.offset = msg.offset
+            handled_offset = msg.offset
+            if log_records:
+                log_debug("Handled message, current offset: %r", self.offset)
+
+        # Writers wait until the reader has gone past the offset of their own record, publishing only the last offset of
+        # the poll covers every record in it with a single notification
+        if add_offsets and handled_offset is not None:
+            with self._published_offset_condition:
+                self.published_offset = handled_offset
+                self._published_offset_condition.notify_all()
+
+    def wait_for_offset(self, offset: int, timeout: Optional[float] = None) -> bool:
+        """ Waits until the record at `offset` has been handled and published.
+
+        Returns False if `timeout` expired first.
+        """
+        with self._published_offset_condition:
+            return self._published_offset_condition.wait_for(lambda: self.published_offset >= offset, timeout)
+
+    def handle_msg(self, key: dict, value: Optional[dict]) -> None:
+        handler = self._msg_handlers.get(key["keytype"])
+        if handler is not None:
+            handler(key, value)
+
+    def _handle_msg_config(self, key: dict, value: Optional[dict]) -> None:
+        if "subject" in key and key["subject"] is not None:
             if not value:
-                subject, version = key["subject"], key["version"]
-                self.log.info("Deleting subject: %r version: %r completely", subject, version)
-                if subject not in self.subjects:
-                    self.log.error("Subject %s did not exist, should have", subject)
-                elif version not in self.subjects[subject]["schemas"]:
-                    self.log.error("Version %d for subject %s did not exist, should have", version, subject)
-                else:
-                    self.subjects[subject]["schemas"].pop(version, None)
+                self.log.info("Deleting compatibility config completely for subject: %r", key["subject"])
+                self.subjects[key["subject"]].pop("compatibility", None)
                 return
-            schema_type = value.get("schemaType", "AVRO")
-            schema_str = value["schema"]
+            self.log.info("Setting subject: %r config to: %r, value: %r", key["subject"], value["compatibilityLevel"], value)
+            if not key["subject"] in self.subjects:
+                self.log.info("Adding first version of subject: %r with no schemas", key["subject"])
+                self._live_schemas[key["subject"]] = {}
+                self.subjects[key["subject"]] = {"schemas": {}}
+            subject_data = self.subjects.get(key["subject"])
+            subject_data["compatibility"] = value["compatibilityLevel"]
+        else:
+            self.log.info("Setting global config to: %r, value: %r", value["compatibilityLevel"], value)
+            self.config["compatibility"] = value["compatibilityLevel"]
+
+    def _handle_msg_schema(self, key: dict, value: Optional[dict]) -> None:
+        if not value:
+            subject, version = key["subject"], key["version"]
+            self.log.info("Deleting subject: %r version: %r completely", subject, version)
+            subject_data = self.subjects.get(subject)
+            if subject_data is None:
+                self.log.error("Subject %s did not exist, should have", subject)
+            elif version not in subject_data["schemas"]:
+                self.log.error("Version %d for subject %s did not exist, should have", version, subject)
+            else:
+                self._remove_live_schema(subject, version)
+                subject_data["schemas"].pop(version, None)
+            return
+        schema_type = SchemaType(value.get("schemaType", "AVRO"))
+        schema_str = value["schema"]
+        # The same schema is commonly registered under several subjects with the same id, reuse the already parsed
+        # schema instead of parsing an identical definition again
+        typed_schema = self.schemas.get(value["id"])
+        if typed_schema is None or typed_schema.schema_type is not schema_type or typed_schema.schema_str != schema_str:
             try:
-                typed_schema = TypedSchema.parse(schema_type=SchemaType(schema_type), schema_str=schema_str)
+                typed_schema = TypedSchema.parse(schema_type=schema_type, schema_str=schema_str)
             except InvalidSchema:
                 try:
-                    schema_json = json.loads(schema_str)
-                    typed_schema = TypedSchema(
-                        schema_type=SchemaType(schema_type), schema=schema_json, schema_str=schema_str
-                    )
+                    schema_json = json_loads(schema_str)
+                    typed_schema = TypedSchema(schema_type=schema_type, schema=schema_json, schema_str=schema_str)
                 except JSONDecodeError:
                     self.log.error("Invalid json: %s", value["schema"])
                     return
-            self.log.debug("Got typed schema %r", typed_schema)
-            subject = value["subject"]
-            if subject not in self.subjects:
-                self.log.info("Adding first version of subject: %r, value: %r", subject, value)
-                self.subjects[subject] = {
-                    "schemas": {
-                        value["version"]: {
-                            "schema": typed_schema,
-                            "version": value["version"],
-                            "id": value["id"],
-                            "deleted": value.get("deleted", False),
-                        }
-                    }
-                }
-                self.log.info("Setting schema_id: %r with schema: %r", value["id"], typed_schema)
-                self.schemas[value["id"]] = typed_schema
-                if value["id"] > self.global_schema_id:  # Not an existing schema
-                    self.global_schema_id = value["id"]
-            elif value.get("deleted", False) is True:
-                self.log.info("Deleting subject: %r, version: %r", subject, value["version"])
-                if not value["version"] in self.subjects[subject]["schemas"]:
-                    self.schemas[value["id"]] = typed_schema
-                else:
-                    self.subjects[subject]["schemas"][value["version"]]["deleted"] = True
-            elif value.get("deleted", False) is False:
-                self.log.info("Adding new version of subject: %r, value: %r", subject, value)
-                self.subjects[subject]["schemas"][value["version"]] = {
-                    "schema": typed_schema,
-                    "version": value["version"],
-                    "id": value["id"],
-                    "deleted": value.get("deleted", False),
-                }
-                self.log.info("Setting schema_id: %r with schema: %r", value["id"], value["schema"])
-                with self.id_lock:
-                    self.schemas[value["id"]] = typed_schema
-                if value["id"] > self.global_schema_id:  # Not an existing schema
-                    self.global_schema_id = value["id"]
-        elif key["keytype"] == "DELETE_SUBJECT":
-            self.log.info("Deleting subject: %r, value: %r", value["subject"], value)
-            if not value["subject"] in self.subjects:
-                self.log.error("Subject: %r did not exist, should have", value["subject"])
+        self.log.debug("Got typed schema %r", typed_schema)
+        subject, version, schema_id = value["subject"], value["version"], value["id"]
+        deleted = value.get("deleted", False)
+        subject_data = self.subjects.get(subject)
+        if subject_data is None:
+            self.log.info("Adding first version of subject: %r, value: %r", subject, value)
+            schema = {
+                "schema": typed_schema,
+                "version": version,
+                "id": schema_id,
+                "deleted": deleted,
+            }
+            # The view is created first, get_schemas() is called for any subject found in `subjects`
+            self._live_schemas[subject] = {} if deleted else {version: schema}
+            self.subjects[subject] = {"schemas": {version: schema}}
+            self.log.info("Setting schema_id: %r with schema: %r", schema_id, typed_schema)
+            self.schemas[schema_id] = typed_schema
+            self.schemas_to_id.setdefault(typed_schema, schema_id)
+            if schema_id > self.global_schema_id:  # Not an existing schema
+                self.global_schema_id = schema_id
+        elif deleted is True:
+            self.log.info("Deleting subject: %r, version: %r", subject, version)
+            subject_schemas = subject_data["schemas"]
+            if version not in subject_schemas:
+                self.schemas[schema_id] = typed_schema
+                self.schemas_to_id.setdefault(typed_schema, schema_id)
             else:
-                updated_schemas = {
-                    key: self._delete_schema_below_version(schema, value["version"])
-                    for key, schema in self.subjects[value["subject"]]["schemas"].items()
-                }
-                self.subjects[value["subject"]]["schemas"] = updated_schemas
-        elif key["keytype"] == "NOOP":  # for spec completeness
-            pass
+                self._remove_live_schema(subject, version)
+                subject_schemas[version]["deleted"] = True
+        elif deleted is False:
+            self.log.info("Adding new version of subject: %r, value: %r", subject, value)
+            subject_schemas = subject_data["schemas"]
+            schema = {
+                "schema": typed_schema,
+                "version": version,
+                "id": schema_id,
+                "deleted": deleted,
+            }
+            readded = version in subject_schemas and version not in self._live_schemas[subject]
+            subject_schemas[version] = schema
+            if readded:
+                # A soft deleted version is added again, the view is rebuilt to keep the versions in the order of `subjects`
+                self._update_live_schemas(subject)
+            else:
+                self._set_live_schema(subject, version, schema)
+            self.log.info("Setting schema_id: %r with schema: %r", schema_id, value["schema"])
+            self.schemas[schema_id] = typed_schema
+            self.schemas_to_id.setdefault(typed_schema, schema_id)
+            if schema_id > self.global_schema_id:  # Not an existing schema
+                self.global_schema_id = schema_id
+
+    def _handle_msg_delete_subject(self, key: dict, value: Optional[dict]) -> None:  # pylint: disable=unused-argument
+        subject, delete_below_version = value["subject"], value["version"]
+        self.log.info("Deleting subject: %r, value: %r", subject, value)
+        subject_data = self.subjects.get(subject)
+        if subject_data is None:
+            self.log.error("Subject: %r did not exist, should have", subject)
+        else:
+            subject_data["schemas"] = {
+                version: self._delete_schema_below_version(schema, delete_below_version)
+                for version, schema in subject_data["schemas"].items()
+            }
+            self._update_live_schemas(subject)
+
+    def _handle_msg_noop(self, key: dict, value: Optional[dict]) -> None:  # pylint: disable=unused-argument
+        # for spec completeness
+        pass
 
     @staticmethod
-    def _delete_schema_below_version(schema, version):
+    def _delete_schema_below_version(schema: dict, version: int) -> dict:
         if schema["version"] <= version:
             schema["deleted"] = True
         return schema
 
+    def _update_live_schemas(self, subject: str) -> None:
+        # A new dict is assigned instead of modifying the existing one, callers of get_schemas iterate it from other
+        # threads
+        self._live_schemas[subject] = {
+            version: schema
+            for version, schema in self.subjects[subject]["schemas"].items()
+            if schema.get("deleted", False) is False
+        }
+
+    def _set_live_schema(self, subject: str, version: int, schema: dict) -> None:
+        # Copy on write, API handlers iterate the views without locking, also while the topic is still being replayed.
+        # The copy is linear in the versions of the subject, so replaying a subject still copies O(V^2) entries in total,
+        # it only avoids re-filtering all the versions in Python for every record.
+        live_schemas = self._live_schemas[subject].copy()
+        live_schemas[version] = schema
+        self._live_schemas[subject] = live_schemas
+
+    def _remove_live_schema(self, subject: str, version: int) -> None:
+        live_schemas = self._live_schemas[subject].copy()
+        live_schemas.pop(version, None)
+        self._live_schemas[subject] = live_schemas
+
     def get_schemas(self, subject, *, include_deleted=False):
         if include_deleted:
             return self.subjects[subject]["schemas"]
-        non_deleted_schemas = {
-            key: val
-            for key, val in self.subjects[subject]["schemas"].items()
-            if val.get("deleted", False) is False
-        }
-        return non_deleted_schemas
+        return self._live_schemas[subject]
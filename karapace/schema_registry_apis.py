@@ -211,19 +211,15 @@ class KarapaceSchemaRegistry(KarapaceBase):
             )
         return compatibility_mode
 
-    def get_offset_from_queue(self, sent_offset):
+    def wait_for_offset(self, sent_offset):
         start_time = time.monotonic()
-        while True:
-            self.log.info("Starting to wait for offset: %r from ksr queue", sent_offset)
-            offset = self.ksr.queue.get()
-            if offset == sent_offset:
-                self.log.info(
-                    "We've consumed back produced offset: %r message back, everything is in sync, took: %.4f", offset,
-                    time.monotonic() - start_time
-                )
-                break
-            self.log.warning("Put the offset: %r back to queue, someone else is waiting for this?", offset)
-            self.ksr.queue.put(offset)
+        self.log.info("Starting to wait for offset: %r from ksr", sent_offset)
+        self.ksr.wait_for_offset(sent_offset)
+        self.log.info(
+            "We've consumed back produced offset: %r message back, everything is in sync, took: %.4f",
+            sent_offset,
+            time.monotonic() - start_time,
+        )
 
     def send_kafka_message(self, key, value):
         if isinstance(key, str):
@@ -235,7 +231,7 @@ class KarapaceSchemaRegistry(KarapaceBase):
         self.producer.flush(timeout=self.kafka_timeout)
         msg = future.get(self.kafka_timeout)
         self.log.debug("Sent kafka msg key: %r, value: %r, offset: %r", key, value, msg.offset)
-        self.get_offset_from_queue(msg.offset)
+        self.wait_for_offset(msg.offset)
         return future
 
     def send_schema_message(
@@ -335,8 +331,7 @@ class KarapaceSchemaRegistry(KarapaceBase):
                 content_type=content_type,
                 status=HTTPStatus.NOT_FOUND,
             )
-        with self.ksr.id_lock:
-            schema = self.ksr.schemas.get(schema_id_int)
+        schema = self.ksr.schemas.get(schema_id_int)
         if not schema:
             self.log.warning("Schema: %r that was requested, not found", int(schema_id))
             self.r(
@@ -366,13 +361,12 @@ class KarapaceSchemaRegistry(KarapaceBase):
             )
 
         subject_versions = []
-        with self.ksr.id_lock:
-            for subject, val in self.ksr.subjects.items():
-                if self.ksr.get_schemas(subject) and "schemas" in val:
-                    schemas = val["schemas"]
-                    for version, schema in schemas.items():
-                        if int(schema["id"]) == schema_id_int and not schema["deleted"]:
-                            subject_versions.append({"subject": subject, "version": int(version)})
+        # The reader thread replaces the dicts returned by get_schemas() instead of modifying them, they can be iterated
+        # without locking. A version can be marked deleted concurrently, so the flag is still checked.
+        for subject in list(self.ksr.subjects):
+            for version, schema in self.ksr.get_schemas(subject).items():
+                if int(schema["id"]) == schema_id_int and not schema["deleted"]:
+                    subject_versions.append({"subject": subject, "version": int(version)})
         subject_versions = sorted(subject_versions, key=lambda s: (s["subject"], s["version"]))
         self.r(subject_versions, content_type)
 
@@ -38,6 +38,8 @@ setup(
         # compression algorithms supported by KafkaConsumer
         "lz4": ["lz4"],
         "zstd": ["python-zstandard"],
+        # faster JSON decoding of the schemas topic
+        "orjson": ["orjson"],
     },
     dependency_links=[],
     package_data={},
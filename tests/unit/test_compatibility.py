@@ -0,0 +1,88 @@
+from collections import OrderedDict
+from karapace import compatibility
+from karapace.avro_compatibility import is_compatible, is_incompatible, ReaderWriterCompatibilityChecker as AvroChecker
+from karapace.compatibility import check_compatibility, CompatibilityModes
+from karapace.schema_reader import SchemaType, TypedSchema
+
+import json
+import pytest
+
+AVRO_RECORD = json.dumps({
+    "type": "record",
+    "name": "Objct",
+    "fields": [{
+        "name": "field",
+        "type": "int"
+    }],
+})
+AVRO_RECORD_WITH_DEFAULT = json.dumps({
+    "type": "record",
+    "name": "Objct",
+    "fields": [{
+        "name": "field",
+        "type": "int"
+    }, {
+        "name": "other",
+        "type": "string",
+        "default": ""
+    }],
+})
+AVRO_RECORD_WITHOUT_DEFAULT = json.dumps({
+    "type": "record",
+    "name": "Objct",
+    "fields": [{
+        "name": "field",
+        "type": "int"
+    }, {
+        "name": "other",
+        "type": "string"
+    }],
+})
+
+
+@pytest.mark.parametrize("mode", list(CompatibilityModes))
+def test_identical_schemas_are_compatible(mode: CompatibilityModes) -> None:
+    old_schema = TypedSchema.parse(SchemaType.AVRO, AVRO_RECORD)
+    new_schema = TypedSchema.parse(SchemaType.AVRO, AVRO_RECORD)
+    assert is_compatible(check_compatibility(old_schema, new_schema, mode))
+
+
+def test_compatibility_modes() -> None:
+    old_schema = TypedSchema.parse(SchemaType.AVRO, AVRO_RECORD)
+    with_default = TypedSchema.parse(SchemaType.AVRO, AVRO_RECORD_WITH_DEFAULT)
+    without_default = TypedSchema.parse(SchemaType.AVRO, AVRO_RECORD_WITHOUT_DEFAULT)
+
+    assert is_compatible(check_compatibility(old_schema, with_default, CompatibilityModes.FULL))
+    assert is_incompatible(check_compatibility(old_schema, without_default, CompatibilityModes.BACKWARD))
+    assert is_compatible(check_compatibility(old_schema, without_default, CompatibilityModes.FORWARD))
+    assert is_incompatible(check_compatibility(old_schema, without_default, CompatibilityModes.FULL_TRANSITIVE))
+
+
+def test_compatibility_results_are_cached(monkeypatch) -> None:
+    checked = []
+
+    class CountingAvroChecker(AvroChecker):
+        def __init__(self) -> None:
+            super().__init__()
+            checked.append(self)
+
+    monkeypatch.setattr(compatibility, "AvroChecker", CountingAvroChecker)
+    monkeypatch.setattr(compatibility, "_compatibility_cache", OrderedDict())
+
+    schema_a = TypedSchema.parse(SchemaType.AVRO, AVRO_RECORD)
+    schema_b = TypedSchema.parse(SchemaType.AVRO, AVRO_RECORD_WITH_DEFAULT)
+
+    assert is_compatible(check_compatibility(schema_a, schema_b, CompatibilityModes.FULL))
+    assert len(checked) == 2
+
+    # Both directions of B -> A were already checked for A -> B
+    assert is_compatible(
+        check_compatibility(schema_b, TypedSchema.parse(SchemaType.AVRO, AVRO_RECORD), CompatibilityModes.FULL)
+    )
+    assert len(checked) == 2
+    # Keyed by fingerprints, not by the full schemas
+    assert set(compatibility._compatibility_cache) == {  # pylint: disable=protected-access
+        (SchemaType.AVRO, schema_a.fingerprint(), schema_b.fingerprint()),
+        (SchemaType.AVRO, schema_b.fingerprint(), schema_a.fingerprint()),
+    }
+    assert len(schema_a.fingerprint()) == 16
@@ -0,0 +1,46 @@
+from karapace.config import set_config_defaults
+from karapace.master_coordinator import MasterCoordinator
+from typing import List, Optional
+
+import json
+
+
+def join(master_coordinator: MasterCoordinator, member_id: str, members: List[str]) -> None:
+    """ Runs a group rebalance on the schema coordinator, with the members in `members` identified by their ports """
+    sc = master_coordinator.sc
+    member_data = [(
+        member,
+        json.dumps({
+            "version": 1,
+            "host": "127.0.0.1",
+            "port": int(member),
+            "scheme": "http",
+            "master_eligibility": True,
+        }).encode("utf8"),
+    ) for member in members]
+    assignments = sc._perform_assignment(members[0], "v0", member_data)  # pylint: disable=protected-access
+    sc._on_join_complete(1, member_id, "v0", assignments[member_id].encode("utf8"))  # pylint: disable=protected-access
+
+
+def test_master_change_callbacks() -> None:
+    master_coordinator = MasterCoordinator(set_config_defaults({"master_election_strategy": "lowest"}))
+    registered_before: List[Optional[bool]] = []
+    registered_after: List[Optional[bool]] = []
+
+    master_coordinator.add_master_change_callback(registered_before.append)
+    assert registered_before == [None]
+
+    master_coordinator.init_schema_coordinator()
+    join(master_coordinator, "8081", ["8081", "8082"])
+    assert master_coordinator.get_master_info() == (True, "http://127.0.0.1:8081")
+
+    # A callback registered after the election gets the current state right away
+    master_coordinator.add_master_change_callback(registered_after.append)
+    assert registered_after == [True]
+
+    # Another member with a lower url joins and is elected
+    join(master_coordinator, "8081", ["8080", "8081"])
+    assert master_coordinator.get_master_info() == (False, "http://127.0.0.1:8080")
+
+    assert registered_before == [None, None, True, None, False]
+    assert registered_after == [True, None, False]
@@ -0,0 +1,157 @@
+from dataclasses import dataclass
+from kafka.errors import KafkaError, TopicAlreadyExistsError
+from kafka.structs import TopicPartition
+from karapace import schema_backup
+from karapace.config import set_config_defaults
+from karapace.schema_backup import SchemaBackup
+from pathlib import Path
+from tests.utils import FakeConsumer, FakeRecord
+from typing import Any, Callable, List, Optional, Tuple
+
+import json
+import pytest
+
+
+@dataclass
+class FakeRecordMetadata:
+    offset: int
+
+
+class FakeFuture:
+    def __init__(self, offset: int) -> None:
+        self.offset = offset
+        self.exception: Optional[Exception] = None
+        self.errbacks: List[Callable[[Exception], Any]] = []
+
+    def add_errback(self, errback: Callable[[Exception], Any]) -> "FakeFuture":
+        self.errbacks.append(errback)
+        return self
+
+    def fail(self, exception: Exception) -> None:
+        self.exception = exception
+        for errback in self.errbacks:
+            errback(exception)
+
+    def get(self, timeout: float) -> FakeRecordMetadata:  # pylint: disable=unused-argument
+        if self.exception is not None:
+            raise self.exception
+        return FakeRecordMetadata(offset=self.offset)
+
+
+class FakeProducer:
+    def __init__(self, fail_at: Optional[int] = None) -> None:
+        self.fail_at = fail_at
+        self.sent: List[Tuple[bytes, Optional[bytes]]] = []
+        self.unflushed: List[FakeFuture] = []
+        self.flushes = 0
+
+    def send(self, topic: str, key: bytes, value: Optional[bytes]) -> FakeFuture:  # pylint: disable=unused-argument
+        future = FakeFuture(len(self.sent))
+        self.sent.append((key, value))
+        self.unflushed.append(future)
+        return future
+
+    def flush(self, timeout: float) -> None:  # pylint: disable=unused-argument
+        # Like kafka-python the futures complete only once the broker has answered, which flush() waits for
+        self.flushes += 1
+        for future in self.unflushed:
+            if future.offset == self.fail_at:
+                future.fail(KafkaError("send failed"))
+        self.unflushed.clear()
+
+    def close(self) -> None:
+        pass
+
+
+def write_backup(path: Path, count: int) -> Path:
+    records = [[{"keytype": "NOOP", "magic": 0, "n": n}, "null"] for n in range(count)]
+    path.write_text(json.dumps(records))
+    return path
+
+
+@pytest.fixture(name="backup_path")
+def fixture_backup_path(tmp_path: Path) -> Path:
+    return tmp_path / "backup.json"
+
+
+def restore(path: Path, producer: FakeProducer, monkeypatch) -> None:
+    backup = SchemaBackup(set_config_defaults({}), str(path))
+    monkeypatch.setattr(backup, "_create_schema_topic_if_needed", lambda: None)
+    backup.producer = producer
+    backup.restore_backup()
+
+
+def test_request_backup(backup_path: Path) -> None:
+    backup = SchemaBackup(set_config_defaults({}), str(backup_path))
+    key = b'{"keytype": "SCHEMA", "subject": "subject", "version": 1, "magic": 1}'
+    value = b'{"subject": "subject", "version": 1, "id": 1, "schema": "\\"string\\""}'
+    backup.consumer = FakeConsumer([{
+        TopicPartition("_schemas", 0): [FakeRecord(key=key, value=value, offset=0)],
+        TopicPartition("_schemas", 1): [
+            FakeRecord(key=b"not json", value=b"not json either", offset=0),
+            FakeRecord(key=key, value=None, offset=1),
+        ],
+    }])
+
+    backup.request_backup()
+
+    assert json.loads(backup_path.read_text()) == [
+        [json.loads(key), json.loads(value)],
+        # Invalid JSON is kept as text
+        ["not json", "not json either"],
+        [json.loads(key), None],
+    ]
+
+
+def test_create_schema_topic_retries_with_the_same_topic(monkeypatch) -> None:
+    created = []
+
+    class AdminClient:
+        @staticmethod
+        def create_topics(new_topics: List[Any], timeout_ms: int) -> None:  # pylint: disable=unused-argument
+            created.extend(new_topics)
+            if len(created) == 1:
+                raise KafkaError("not yet")
+            raise TopicAlreadyExistsError()
+
+    backup = SchemaBackup(set_config_defaults({}), "")
+    monkeypatch.setattr(backup, "init_admin_client", lambda: setattr(backup, "admin_client", AdminClient()))
+    monkeypatch.setattr(schema_backup.time, "sleep", lambda seconds: None)
+
+    backup._create_schema_topic_if_needed()  # pylint: disable=protected-access
+
+    assert len(created) == 2
+    assert created[0] is created[1]
+
+
+def test_restore_backup_flushes_in_batches(backup_path: Path, monkeypatch) -> None:
+    monkeypatch.setattr(schema_backup, "RESTORE_BATCH_SIZE", 2)
+    producer = FakeProducer()
+
+    restore(write_backup(backup_path, 5), producer, monkeypatch)
+
+    assert [json.loads(key)["n"] for key, _ in producer.sent] == [0, 1, 2, 3, 4]
+    assert all(value is None for _, value in producer.sent)
+    assert producer.flushes == 3
+
+
+def test_restore_backup_stops_at_failed_send(backup_path: Path, monkeypatch, caplog) -> None:
+    monkeypatch.setattr(schema_backup, "RESTORE_BATCH_SIZE", 2)
+    producer = FakeProducer(fail_at=2)
+
+    with pytest.raises(KafkaError):
+        restore(write_backup(backup_path, 10), producer, monkeypatch)
+
+    # The failure is noticed when its batch is flushed, no records are sent after that batch
+    assert [json.loads(key)["n"] for key, _ in producer.sent] == [0, 1, 2, 3]
+    assert "Restoring record 2 " in caplog.text
+
+
+def test_restore_producer_keeps_records_in_order(monkeypatch) -> None:
+    producer_configs = []
+    monkeypatch.setattr(schema_backup, "KafkaProducer", lambda **config: producer_configs.append(config))
+
+    SchemaBackup(set_config_defaults({}), "").init_producer()
+
+    assert producer_configs[0]["max_in_flight_requests_per_connection"] == 1
+    assert producer_configs[0]["retries"] > 0
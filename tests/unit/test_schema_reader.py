@@ -0,0 +1,192 @@
+from concurrent.futures import ThreadPoolExecutor
+from kafka.structs import TopicPartition
+from karapace import schema_reader
+from karapace.config import set_config_defaults
+from karapace.schema_reader import KafkaSchemaReader, SchemaType, TypedSchema
+from tests.utils import FakeConsumer, FakeRecord
+from typing import Callable, List, Optional
+
+import json
+import pytest
+import time
+
+SCHEMA_STR = json.dumps({"type": "string"})
+
+
+def schema_record(offset: int, subject: str, version: int, schema_id: int, **extra) -> FakeRecord:
+    key = {"keytype": "SCHEMA", "subject": subject, "version": version, "magic": 1}
+    value = {"subject": subject, "version": version, "id": schema_id, "schema": SCHEMA_STR, **extra}
+    return FakeRecord(key=json.dumps(key).encode("utf8"), value=json.dumps(value).encode("utf8"), offset=offset)
+
+
+@pytest.fixture(name="reader")
+def fixture_reader() -> KafkaSchemaReader:
+    reader = KafkaSchemaReader(set_config_defaults({}))
+    reader.consumer = FakeConsumer()
+    return reader
+
+
+def feed(reader: KafkaSchemaReader, *records: FakeRecord) -> None:
+    reader.consumer.batches.append({TopicPartition(reader.config["topic_name"], 0): list(records)})
+    reader.handle_messages()
+
+
+def test_handle_messages_registers_schemas(reader: KafkaSchemaReader) -> None:
+    feed(reader, schema_record(0, "subject", 1, 1), schema_record(1, "other", 1, 1))
+
+    assert reader.offset == 1
+    assert reader.global_schema_id == 1
+    assert reader.schemas[1] == TypedSchema.parse(SchemaType.AVRO, SCHEMA_STR)
+    assert list(reader.get_schemas("subject")) == [1]
+    assert list(reader.get_schemas("other")) == [1]
+    # The schema is parsed once and shared by every subject registering it with the same id
+    assert reader.subjects["subject"]["schemas"][1]["schema"] is reader.subjects["other"]["schemas"][1]["schema"]
+
+
+def test_handle_messages_skips_invalid_json(reader: KafkaSchemaReader) -> None:
+    feed(reader, FakeRecord(key=b"{invalid", value=b"{}", offset=0), schema_record(1, "subject", 1, 1))
+
+    assert reader.offset == 1
+    assert list(reader.subjects) == ["subject"]
+
+
+def test_get_schema_id(reader: KafkaSchemaReader) -> None:
+    feed(reader, schema_record(0, "subject", 1, 1), schema_record(1, "subject", 2, 2, schemaType="JSON"))
+
+    assert reader.get_schema_id(TypedSchema.parse(SchemaType.AVRO, SCHEMA_STR)) == 1
+    assert reader.get_schema_id(TypedSchema.parse(SchemaType.JSONSCHEMA, SCHEMA_STR)) == 2
+    assert reader.get_schema_id(TypedSchema.parse(SchemaType.AVRO, json.dumps({"type": "int"}))) == 3
+
+
+def test_handle_msg_dispatch(reader: KafkaSchemaReader) -> None:
+    key = {"keytype": "SCHEMA", "subject": "subject", "version": 1}
+    reader.handle_msg(key, {"subject": "subject", "version": 1, "id": 1, "schema": SCHEMA_STR})
+    reader.handle_msg({"keytype": "CONFIG", "subject": "subject"}, {"compatibilityLevel": "FULL"})
+    reader.handle_msg({"keytype": "CONFIG", "subject": None}, {"compatibilityLevel": "NONE"})
+    reader.handle_msg({"keytype": "NOOP"}, None)
+    reader.handle_msg({"keytype": "UNKNOWN"}, None)
+
+    assert reader.subjects["subject"]["compatibility"] == "FULL"
+    assert reader.config["compatibility"] == "NONE"
+
+    reader.handle_msg({"keytype": "DELETE_SUBJECT", "subject": "subject"}, {"subject": "subject", "version": 1})
+
+    assert reader.get_schemas("subject") == {}
+    assert list(reader.get_schemas("subject", include_deleted=True)) == [1]
+
+
+def test_handle_messages_publishes_last_offset() -> None:
+    class MasterCoordinator:
+        def __init__(self) -> None:
+            self.callbacks: List[Callable[[Optional[bool]], None]] = []
+
+        def add_master_change_callback(self, callback: Callable[[Optional[bool]], None]) -> None:
+            self.callbacks.append(callback)
+            callback(None)
+
+    master_coordinator = MasterCoordinator()
+    reader = KafkaSchemaReader(set_config_defaults({}), master_coordinator=master_coordinator)
+    reader.consumer = FakeConsumer()
+    reader.handle_messages()
+    assert reader.ready
+
+    # No offsets are published before the election has finished
+    feed(reader, schema_record(0, "subject", 1, 1))
+    assert reader.published_offset == -1
+
+    master_coordinator.callbacks[0](True)
+    feed(reader, schema_record(1, "subject", 2, 1), schema_record(2, "subject", 3, 1))
+    assert reader.published_offset == 2
+
+    master_coordinator.callbacks[0](False)
+    feed(reader, schema_record(3, "subject", 4, 1))
+    assert reader.published_offset == 2
+
+
+def test_wait_for_offset(reader: KafkaSchemaReader) -> None:
+    reader._on_master_change(True)  # pylint: disable=protected-access
+    reader.handle_messages()
+    waiters = ThreadPoolExecutor(max_workers=2)
+    first = waiters.submit(reader.wait_for_offset, 1)
+    second = waiters.submit(reader.wait_for_offset, 3)
+
+    feed(reader, schema_record(0, "subject", 1, 1), schema_record(1, "subject", 2, 1))
+    assert first.result(timeout=5) is True
+    assert not second.done()
+
+    # A writer whose offset was already published is released even while another one is still waiting
+    assert reader.wait_for_offset(0, timeout=0) is True
+    assert reader.wait_for_offset(2, timeout=0.01) is False
+
+    feed(reader, schema_record(2, "subject", 3, 1), schema_record(3, "subject", 4, 1))
+    assert second.result(timeout=5) is True
+    waiters.shutdown()
+
+
+def test_get_schemas_tracks_deletions(reader: KafkaSchemaReader) -> None:
+    feed(
+        reader,
+        schema_record(0, "subject", 1, 1),
+        schema_record(1, "subject", 2, 2, schemaType="JSON"),
+        schema_record(2, "subject", 3, 1),
+        schema_record(3, "subject", 2, 2, schemaType="JSON", deleted=True),
+    )
+    assert list(reader.get_schemas("subject")) == [1, 3]
+
+    # Permanent deletion of a version
+    feed(reader, FakeRecord(key=b'{"keytype": "SCHEMA", "subject": "subject", "version": 3}', value=None, offset=4))
+    assert list(reader.get_schemas("subject")) == [1]
+    assert list(reader.get_schemas("subject", include_deleted=True)) == [1, 2]
+
+
+def test_close_interrupts_init_retry(reader: KafkaSchemaReader, monkeypatch) -> None:
+    attempts: List[None] = []
+
+    def init_admin_client() -> bool:
+        attempts.append(None)
+        return False
+
+    monkeypatch.setattr(reader, "init_admin_client", init_admin_client)
+    monkeypatch.setattr(schema_reader, "INIT_RETRY_BACKOFF_MIN_S", 60.0)
+    reader.start()
+    while not attempts:
+        time.sleep(0.01)
+
+    reader.close()
+    # The backoff wait ends on close instead of running for its full duration
+    reader.join(timeout=5)
+    assert not reader.is_alive()
+    assert len(attempts) == 1
+
+
+def test_get_schemas_available_when_subject_is_added(reader: KafkaSchemaReader) -> None:
+    class Subjects(dict):
+        def __setitem__(self, subject, subject_data):
+            # API handlers call get_schemas() for every subject they find
+            assert reader.get_schemas(subject) is not None
+            super().__setitem__(subject, subject_data)
+
+    reader.subjects = Subjects()
+    config_key = b'{"keytype": "CONFIG", "subject": "configured", "magic": 0}'
+    feed(
+        reader,
+        FakeRecord(key=config_key, value=b'{"compatibilityLevel": "FULL"}', offset=0),
+        schema_record(1, "subject", 1, 1),
+    )
+    assert reader.get_schemas("configured") == {}
+    assert list(reader.get_schemas("subject")) == [1]
+
+
+def test_get_schemas_keeps_version_order_when_version_is_readded(reader: KafkaSchemaReader) -> None:
+    feed(
+        reader,
+        schema_record(0, "subject", 1, 1),
+        schema_record(1, "subject", 2, 1),
+        schema_record(2, "subject", 3, 1),
+        schema_record(3, "subject", 2, 1, deleted=True),
+    )
+    assert list(reader.get_schemas("subject")) == [1, 3]
+
+    feed(reader, schema_record(4, "subject", 2, 1))
+    assert list(reader.get_schemas("subject")) == [1, 2, 3]
+    assert list(reader.get_schemas("subject")) == list(reader.get_schemas("subject", include_deleted=True))
@@ -1,8 +1,9 @@
 from aiohttp.client_exceptions import ClientOSError, ServerDisconnectedError
 from dataclasses import dataclass
 from kafka.errors import TopicAlreadyExistsError
+from kafka.structs import TopicPartition
 from karapace.utils import Client
-from typing import Callable, List
+from typing import Callable, Dict, List, Optional
 from urllib.parse import quote
 
 import asyncio
@@ -105,6 +106,27 @@ class Timeout(Exception):
     pass
 
 
+@dataclass
+class FakeRecord:
+    key: bytes
+    value: Optional[bytes]
+    offset: int
+
+
+class FakeConsumer:
+    """ Stands in for a KafkaConsumer, each poll returns the next of `batches` """
+    def __init__(self, batches: Optional[List[Dict[TopicPartition, List[FakeRecord]]]] = None) -> None:
+        self.batches = batches if batches is not None else []
+
+    def poll(self, timeout_ms: int) -> Dict[TopicPartition, List[FakeRecord]]:  # pylint: disable=unused-argument
+        if self.batches:
+            return self.batches.pop(0)
+        return {}
+
+    def close(self) -> None:
+        pass
+
+
 @dataclass
 class KafkaConfig:
     datadir: str